@@ -0,0 +1,138 @@
+/*
+ * Access-Request 封包熱路徑的 C 實作
+ *
+ * 在釋放 GIL 的情況下以 OpenSSL 產生 Request Authenticator、加密 User-Password
+ * 並計算 Message-Authenticator (HMAC-MD5)，讓其他執行緒在這段時間可以繼續執行。
+ * 未編譯時 radius_client 會使用純 Python 實作。
+ *
+ * 編譯：
+ *   gcc -O2 -shared -fPIC $(python3-config --includes) _radius_fast.c -lcrypto \
+ *       -o _radius_fast$(python3-config --extension-suffix)
+ */
+#define PY_SSIZE_T_CLEAN
+#include <Python.h>
+#include <string.h>
+#include <openssl/evp.h>
+#include <openssl/hmac.h>
+#include <openssl/rand.h>
+
+/* 以 template 為底填入新的 Identifier、Request Authenticator、User-Password 與 Message-Authenticator */
+static int
+fill_access_request(unsigned char *buf, const unsigned char *template, Py_ssize_t len, int identifier,
+                    const unsigned char *secret, Py_ssize_t secret_len,
+                    const unsigned char *password, Py_ssize_t password_len,
+                    Py_ssize_t password_offset, Py_ssize_t authenticator_offset)
+{
+    unsigned char digest[EVP_MAX_MD_SIZE];
+    unsigned int digest_len;
+    const unsigned char *last;
+    Py_ssize_t padded_len = (password_len + 15) / 16 * 16;
+    Py_ssize_t i, j;
+    EVP_MD_CTX *ctx;
+
+    memcpy(buf, template, len);
+    buf[1] = (unsigned char)identifier;
+    if (RAND_bytes(buf + 4, 16) != 1)
+        return 0;
+
+    /* RFC 2865 5.2：b1 = MD5(secret + RA)、bi = MD5(secret + c(i-1))，ci = pi XOR bi */
+    ctx = EVP_MD_CTX_new();
+    if (ctx == NULL)
+        return 0;
+    last = buf + 4;
+    for (i = 0; i < padded_len; i += 16) {
+        if (!EVP_DigestInit_ex(ctx, EVP_md5(), NULL)
+            || !EVP_DigestUpdate(ctx, secret, secret_len)
+            || !EVP_DigestUpdate(ctx, last, 16)
+            || !EVP_DigestFinal_ex(ctx, digest, &digest_len)) {
+            EVP_MD_CTX_free(ctx);
+            return 0;
+        }
+        for (j = 0; j < 16; j++) {
+            unsigned char p = i + j < password_len ? password[i + j] : 0;
+            buf[password_offset + i + j] = digest[j] ^ p;
+        }
+        last = buf + password_offset + i;
+    }
+    EVP_MD_CTX_free(ctx);
+
+    /* Message-Authenticator 先填 16 bytes 的零計算 HMAC-MD5，再寫回 */
+    memset(buf + authenticator_offset, 0, 16);
+    if (HMAC(EVP_md5(), secret, (int)secret_len, buf, (size_t)len, digest, &digest_len) == NULL)
+        return 0;
+    memcpy(buf + authenticator_offset, digest, 16);
+    return 1;
+}
+
+static PyObject *
+build_access_request(PyObject *self, PyObject *args)
+{
+    Py_buffer template, secret, password;
+    int identifier, ok;
+    Py_ssize_t password_offset, authenticator_offset;
+    PyObject *packet = NULL;
+
+    if (!PyArg_ParseTuple(args, "y*iy*y*nn", &template, &identifier, &secret, &password,
+                          &password_offset, &authenticator_offset))
+        return NULL;
+
+    if (identifier < 0 || identifier > 255
+        || template.len < 20
+        || password_offset < 20
+        || password_offset + (password.len + 15) / 16 * 16 > template.len
+        || authenticator_offset < 20
+        || authenticator_offset + 16 > template.len) {
+        PyErr_SetString(PyExc_ValueError, "invalid Access-Request template");
+        goto done;
+    }
+
+    packet = PyBytes_FromStringAndSize(NULL, template.len);
+    if (packet == NULL)
+        goto done;
+
+    /* packet 尚未交給任何人，輸入皆為不可變的 bytes，可以安全地在釋放 GIL 時寫入 */
+    Py_BEGIN_ALLOW_THREADS
+    ok = fill_access_request((unsigned char *)PyBytes_AS_STRING(packet), template.buf, template.len, identifier,
+                             secret.buf, secret.len, password.buf, password.len,
+                             password_offset, authenticator_offset);
+    Py_END_ALLOW_THREADS
+
+    if (!ok) {
+        Py_CLEAR(packet);
+        PyErr_SetString(PyExc_RuntimeError, "OpenSSL failed to build Access-Request");
+    }
+
+done:
+    PyBuffer_Release(&template);
+    PyBuffer_Release(&secret);
+    PyBuffer_Release(&password);
+    return packet;
+}
+
+static PyMethodDef radius_fast_methods[] = {
+    {"build_access_request", build_access_request, METH_VARARGS,
+     "build_access_request(template, identifier, secret, password, password_offset, authenticator_offset) -> bytes"},
+    {NULL, NULL, 0, NULL}
+};
+
+static PyModuleDef_Slot radius_fast_slots[] = {
+#ifdef Py_GIL_DISABLED
+    {Py_mod_gil, Py_MOD_GIL_NOT_USED},
+#endif
+    {0, NULL}
+};
+
+static struct PyModuleDef radius_fast_module = {
+    PyModuleDef_HEAD_INIT,
+    "_radius_fast",
+    "Access-Request packet hot path with the GIL released",
+    0,
+    radius_fast_methods,
+    radius_fast_slots,
+};
+
+PyMODINIT_FUNC
+PyInit__radius_fast(void)
+{
+    return PyModuleDef_Init(&radius_fast_module);
+}
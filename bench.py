@@ -1,210 +1,211 @@
 import os
 import time
 import csv
-import threading
-import queue
-import hmac
-import hashlib
+import sys
+import asyncio
 import argparse
-from collections import defaultdict
+import math
+import bisect
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from enum import IntEnum
 from typing import Dict, Any
 
-# 使用 pyrad 函式庫來處理 RADIUS 協議
-from pyrad.client import Client
-from pyrad.dictionary import Dictionary
-import pyrad.packet
-import six
+from hdrh.histogram import HdrHistogram
+
+# 使用 asyncio UDP 直接組出並發送 RADIUS 封包
+import radius_client
+from radius_client import RadiusClient, AccessRequestTemplate
 
-# --- 全域變數和鎖，用於在多執行緒環境下安全地共享數據 ---
 
-# 用於儲存每個請求的詳細結果
-results = []
-results_lock = threading.Lock()
+# 請求的結果狀態
+class Status(IntEnum):
+    SUCCEEDED = 0
+    NO_REPLY = 1
+    FAILED = 2
 
-# 用於即時統計匯總數據
-stats: Dict[str, Any] = {
-    'total_sent': 0,
-    'total_succeeded': 0,
-    'total_failed': 0,
-    'total_no_reply': 0,
-    'response_times': defaultdict(int)
-}
-stats_lock = threading.Lock()
 
-# 封包 ID 計數器
-packet_id_counter = 0
-packet_id_lock = threading.Lock()
+# 回應時間分類的上界 (微秒)，最後一個區間為 >= 1s
+TIME_BOUNDS_US = [10_000, 50_000, 100_000, 200_000, 500_000, 1_000_000]  # 200ms 是常見的 SLO 目標
+TIME_CATEGORIES = ['< 10ms', '< 50ms', '< 100ms', '< 200ms', '< 500ms', '< 1s', '>= 1s']
+
+
+# --- 統計數據：每個事件迴圈執行緒各自累計一份，測試結束後再合併，執行緒之間不共用可變狀態 ---
+
+def new_stats() -> Dict[str, Any]:
+    """
+    建立一份空的統計數據。
+    response_times 為回應時間分佈 (微秒，1us ~ 60s，3 位有效數字)，記憶體用量固定，不隨測試長度增加，只用來取百分位數；
+    response_categories 為各 TIME_CATEGORIES 區間的請求數，在記錄時以 bisect 精確分類。
+    """
+    return {
+        'total_sent': 0,
+        'total_succeeded': 0,
+        'total_failed': 0,
+        'total_no_reply': 0,
+        'response_times': HdrHistogram(1, 60_000_000, 3),
+        'response_categories': [0] * len(TIME_CATEGORIES)
+    }
+
+
+def merge_stats(target: Dict[str, Any], source: Dict[str, Any]):
+    """把 source 的計數與回應時間分佈累加到 target"""
+    for key in ('total_sent', 'total_succeeded', 'total_failed', 'total_no_reply'):
+        target[key] += source[key]
+    target['response_times'].add(source['response_times'])
+    for i, count in enumerate(source['response_categories']):
+        target['response_categories'][i] += count
+
+
+# 用於匯總所有執行緒的統計數據
+stats: Dict[str, Any] = new_stats()
 
 
 # --- RADIUS 相關的核心函式 ---
 
-def create_radius_client(server: str, secret: bytes) -> Client:
-    """建立並配置一個 RADIUS 客戶端實例"""
-    client = Client(server=server, authport=31812, secret=secret, dict=Dictionary("dictionary"))
+async def create_radius_client(server: tuple, secret: bytes, max_inflight: int) -> RadiusClient:
+    """建立並配置一個 RADIUS 客戶端實例，每個 socket 最多 SOCKET_INFLIGHT 個進行中的請求"""
+    sockets = math.ceil(max_inflight / radius_client.SOCKET_INFLIGHT)
+    client = await radius_client.open_client(server, secret, sockets=sockets)
     client.timeout = 5  # 設置請求超時為 5 秒
     client.retries = 2  # 設置重試次數為 2 次
     return client
 
 
-def categorize_response_time(duration: float) -> str:
-    """將回應時間 (秒) 分類到不同的區間"""
-    if duration < 0.01: return '< 10ms'
-    if duration < 0.05: return '< 50ms'
-    if duration < 0.1: return '< 100ms'
-    if duration < 0.2: return '< 200ms'  # 這是常見的 SLO 目標
-    if duration < 0.5: return '< 500ms'
-    if duration < 1.0: return '< 1s'
-    return '>= 1s'
+def percentile_latency(histogram: HdrHistogram, percentile: float) -> float:
+    """取出指定百分位數的回應時間 (秒)，沒有樣本時為 0"""
+    return histogram.get_value_at_percentile(percentile) / 1_000_000
 
 
-def send_auth_request(client: Client, username: str, password: str, secret: bytes):
+async def send_auth_request(client: RadiusClient, template: AccessRequestTemplate, pkt_id: int,
+                            stats: Dict[str, Any], write_row=None):
     """
-    發送單一的 RADIUS 認證請求並記錄結果。
-    這個函式是執行緒中實際執行的工作。
+    發送單一的 RADIUS 認證請求並把結果記錄到所屬執行緒的 stats。
+    有提供 write_row 時會把這筆結果直接寫入 CSV。
     """
-    global packet_id_counter
-    with packet_id_lock:
-        pkt_id = packet_id_counter
-        packet_id_counter += 1
-
-    start_time = time.monotonic()
+    start_ns = time.monotonic_ns()
 
     try:
-        # 建立 RADIUS Access-Request 封包
-        req = client.CreateAuthPacket(code=pyrad.packet.AccessRequest, User_Name=username)
-        req["User-Password"] = req.PwCrypt(password)
-
-        # 為了安全，RADIUS協定要求一個 Message-Authenticator
-        # 這裡我們先填入 16 bytes 的零
-        req["Message-Authenticator"] = 16 * six.b("\x00")
-        raw_packet = req.RequestPacket()
-
-        # 使用 HMAC-MD5 和 secret 計算正確的 Message-Authenticator
-        digest = hmac.new(secret, raw_packet, hashlib.md5).digest()
-        req["Message-Authenticator"] = digest
-
-        # 發送封包並等待回應
-        reply = client.SendPacket(req)
+        # 以預先組好的樣板送出 Access-Request 並等待回應
+        await client.authenticate(template)
 
         # 請求成功
-        with stats_lock:
-            stats['total_succeeded'] += 1
-        status = 'succeeded'
+        stats['total_succeeded'] += 1
+        status = Status.SUCCEEDED
 
-    except pyrad.client.Timeout as e:
+    except radius_client.Timeout:
         # 請求超時，沒有收到回應
-        with stats_lock:
-            stats['total_no_reply'] += 1
-        status = 'no_reply'
-    except Exception as e:
+        stats['total_no_reply'] += 1
+        status = Status.NO_REPLY
+    except Exception:
         # 其他類型的錯誤
-        with stats_lock:
-            stats['total_failed'] += 1
-        status = f'failed: {e}'
-
-    end_time = time.monotonic()
-    duration = end_time - start_time
-
-    # 無論成功或失敗，都更新總發送數和回應時間分類
-    with stats_lock:
-        stats['total_sent'] += 1
-        category = categorize_response_time(duration)
-        stats['response_times'][category] += 1
+        stats['total_failed'] += 1
+        status = Status.FAILED
 
-    # 將詳細結果加入列表，以便後續分析 (如計算P95)
-    with results_lock:
-        results.append({
-            'pkt_id': pkt_id,
-            'status': status,
-            'start_time': start_time,
-            'duration': duration
-        })
+    # 以整數奈秒計時，不經過浮點數
+    duration_ns = time.monotonic_ns() - start_ns
 
+    # 無論成功或失敗，都更新總發送數和回應時間
+    stats['total_sent'] += 1
+    duration_us = duration_ns // 1000
+    stats['response_times'].record_value(duration_us)
+    # HdrHistogram 的區間在數十毫秒以上寬達數十微秒，與分類上界不對齊，分類在這裡直接計數
+    stats['response_categories'][bisect.bisect_right(TIME_BOUNDS_US, duration_us)] += 1
 
-# --- 壓力測試執行框架 (Producer-Consumer 模式) ---
+    # 詳細結果逐筆寫入 CSV (秒)，不保留在記憶體中
+    if write_row is not None:
+        write_row((pkt_id, status.name.lower(), start_ns / 1e9, duration_ns / 1e9))
 
-def consumer_worker(task_queue: queue.Queue, server: str, secret: bytes):
-    """
-    消費者執行緒：從隊列中取出任務並執行。
-    每個執行緒會建立自己的 RADIUS client，避免共享造成的執行緒安全問題。
-    """
-    client = create_radius_client(server, secret)
-    while True:
-        task = task_queue.get()
-        # 如果收到 None，代表任務結束，退出循環
-        if task is None:
-            break
-
-        send_auth_request(client, task['username'], task['password'], secret)
-        task_queue.task_done()
 
+# --- 壓力測試執行框架 (每個執行緒一個 asyncio 事件迴圈，worker 依共用時鐘自行控制速率) ---
 
-def run_test(rps: int, duration: int, workers: int, server: str, secret: bytes):
+def run_test(rps: int, duration: int, max_inflight: int, server: tuple, secret: bytes, writer=None, threads: int = 1):
     """
-    執行壓力測試的主函式 (Producer)。
-    它會以指定的 RPS 速率向隊列中放入任務，持續指定的秒數。
+    執行壓力測試的主函式，server 為 radius_client.resolve_server() 解析好的位址。
+    啟動 threads 個執行緒，各自執行一個事件迴圈並平分 max_inflight 個 worker coroutine。
+    請求依編號交錯分給各執行緒 (執行緒 k 負責 k, k + threads, ...)，
+    worker 自行睡到該請求的派發時間點 (start + i * 10^9 // rps 奈秒) 再送出，持續指定的秒數。
+    每個 worker 同時只會有一個進行中的請求，worker 全部在等待回應時派發會暫停。
     """
-    print(f"🚀 Starting test: {rps} RPS for {duration} seconds with {workers} workers...")
+    threads = max(1, min(threads, max_inflight))
+    print(f"🚀 Starting test: {rps} RPS for {duration} seconds with {max_inflight} max in-flight "
+          f"on {threads} thread(s)...")
 
-    task_queue: queue.Queue = queue.Queue(maxsize=workers * 2)
-    threads = []
+    write_row = None
+    if writer is not None:
+        writer_lock = threading.Lock()
 
-    # 建立並啟動消費者執行緒
-    for _ in range(workers):
-        thread = threading.Thread(target=consumer_worker, args=(task_queue, server, secret))
-        thread.start()
-        threads.append(thread)
+        def write_row(row):
+            with writer_lock:
+                writer.writerow(row)
 
-    # 生產者邏輯
-    start_time = time.monotonic()
-    test_end_time = start_time + duration
-    interval = 1.0 / rps
+    # 派發時間點以整數奈秒計算，長時間測試也不會累積浮點誤差
+    start_ns = time.monotonic_ns()
+    test_end_ns = start_ns + duration * 1_000_000_000
     total_tasks = rps * duration
 
-    for i in range(total_tasks):
-        if time.monotonic() > test_end_time:
-            print("⚠️ Test duration elapsed, stopping producer.")
-            break
-
-        # 構造任務並放入隊列
-        task = {"username": "testuser", "password": "testpassword"}
-        task_queue.put(task)
-
-        # 透過精確計算下一次派發的時間點來維持穩定的 RPS，避免誤差累積
-        next_dispatch_time = start_time + (i + 1) * interval
-        sleep_duration = next_dispatch_time - time.monotonic()
-        if sleep_duration > 0:
-            time.sleep(sleep_duration)
-
-    # 所有任務都已放入隊列，發送結束信號 (None)
-    for _ in range(workers):
-        task_queue.put(None)
-
-    # 等待所有消費者執行緒處理完畢並退出
-    for thread in threads:
-        thread.join()
-
+    async def run_thread(index: int, thread_inflight: int):
+        """單一執行緒的事件迴圈，回傳這個執行緒的 stats 以及是否因時間到而提前停止"""
+        client = await create_radius_client(server, secret, thread_inflight)
+        # 帳號密碼在整個測試中不變，封包只需組一次
+        template = client.create_auth_template(b"testuser", b"testpassword")
+        thread_stats = new_stats()
+        # 只有這個執行緒的事件迴圈會使用 counter，不需要鎖
+        counter = itertools.count(index, threads)
+        stopped_early = False
+
+        async def worker():
+            nonlocal stopped_early
+            while True:
+                i = next(counter)
+                if i >= total_tasks:
+                    return
+
+                # 透過精確計算派發時間點來維持穩定的 RPS，避免誤差累積
+                now_ns = time.monotonic_ns()
+                deadline_ns = start_ns + i * 1_000_000_000 // rps
+                if now_ns < deadline_ns:
+                    await asyncio.sleep((deadline_ns - now_ns) / 1e9)
+                elif now_ns > test_end_ns:
+                    stopped_early = True
+                    return
+
+                await send_auth_request(client, template, i, thread_stats, write_row)
+
+        # 等待所有 worker 送完並收到回應
+        await asyncio.gather(*(worker() for _ in range(thread_inflight)))
+        client.close()
+        return thread_stats, stopped_early
+
+    # 與 perf.py 分配封包的方式相同，把 max_inflight 平分給各執行緒
+    inflight = [max_inflight // threads + (1 if i < max_inflight % threads else 0) for i in range(threads)]
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        outcomes = list(executor.map(lambda i: radius_client.run(run_thread(i, inflight[i])), range(threads)))
+
+    for thread_stats, _ in outcomes:
+        merge_stats(stats, thread_stats)
+
+    if any(stopped_early for _, stopped_early in outcomes):
+        print("⚠️ Test duration elapsed, stopping producer.")
     print("✅ Test finished.")
 
 
 # --- 數據統計與報告 ---
 
-def save_results_to_csv(filename: str):
-    """將詳細結果儲存到 CSV 檔案"""
-    if not results:
-        return
-
-    print(f"\n💾 Saving results to {filename}...")
+@contextmanager
+def open_results_csv(filename: str):
+    """開啟詳細結果的 CSV 檔案，回傳在測試期間逐筆寫入的 csv writer (依完成順序)"""
+    print(f"💾 Saving results to {filename}...")
     # 建立 results 目錄 (如果不存在)
     os.makedirs(os.path.dirname(filename), exist_ok=True)
 
-    with open(filename, 'w', newline='') as csvfile:
-        fieldnames = ['pkt_id', 'status', 'start_time', 'duration']
-        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-        writer.writeheader()
-
-        sorted_results = sorted(results, key=lambda x: x['pkt_id'])
-        writer.writerows(sorted_results)
+    # 測試期間每完成一筆就寫一列，以 1 MiB 的緩衝區累積後再寫入磁碟
+    with open(filename, 'w', buffering=1 << 20, newline='') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(['pkt_id', 'status', 'start_time', 'duration'])
+        yield writer
 
 
 def print_statistics(total_time: float):
@@ -223,19 +224,14 @@ def print_statistics(total_time: float):
     print(f"    - Total Time        : {total_time:.2f} s")
 
     print("\n--- ⏱️ Response Time Distribution ---")
-    time_categories = ['< 10ms', '< 50ms', '< 100ms', '< 200ms', '< 500ms', '< 1s', '>= 1s']
-    for category in time_categories:
-        count = stats['response_times'].get(category, 0)
+    for category, count in zip(TIME_CATEGORIES, stats['response_categories']):
         percentage = (count / total_sent * 100) if total_sent > 0 else 0
         print(f"    - {category:<10}: {count:<6} ({percentage:.2f}%)")
 
     # 計算 P95, P99 延遲
-    if results:
-        durations = sorted([r['duration'] for r in results])
-        p95_index = int(len(durations) * 0.95) - 1
-        p99_index = int(len(durations) * 0.99) - 1
-        p95_latency = durations[p95_index] if p95_index >= 0 else 0
-        p99_latency = durations[p99_index] if p99_index >= 0 else 0
+    if total_sent:
+        p95_latency = percentile_latency(stats['response_times'], 95)
+        p99_latency = percentile_latency(stats['response_times'], 99)
         print("\n--- 📈 Percentile Latencies ---")
         print(f"    - P95 Latency       : {p95_latency * 1000:.2f} ms")
         print(f"    - P99 Latency       : {p99_latency * 1000:.2f} ms")
@@ -245,16 +241,8 @@ def print_statistics(total_time: float):
 
 def reset_stats():
     """重置全域統計數據，用於 ramp 模式"""
-    global results, stats, packet_id_counter
-    results.clear()
-    stats = {
-        'total_sent': 0,
-        'total_succeeded': 0,
-        'total_failed': 0,
-        'total_no_reply': 0,
-        'response_times': defaultdict(int)
-    }
-    packet_id_counter = 0
+    global stats
+    stats = new_stats()
 
 
 # --- 主程式入口與命令列參數解析 ---
@@ -266,7 +254,11 @@ def main():
     )
     parser.add_argument('--server', default='127.0.0.1', help='RADIUS server IP address')
     parser.add_argument('--secret', default='testing123', help='RADIUS secret')
-    parser.add_argument('-w', '--workers', type=int, default=50, help='Number of consumer worker threads')
+    parser.add_argument('-i', '--max-inflight', type=int, default=1024,
+                        help='Maximum number of concurrent in-flight requests')
+    parser.add_argument('-t', '--threads', type=int, default=1,
+                        help='Number of event-loop threads. Only scales on a free-threaded build\n'
+                             '(python3.13t with PYTHON_GIL=0), where os.cpu_count() is the sweet spot')
 
     subparsers = parser.add_subparsers(dest='mode', required=True, help='Test mode')
 
@@ -286,16 +278,23 @@ def main():
 
     args = parser.parse_args()
     secret_bytes = args.secret.encode()
+    # 伺服器位址只解析一次，所有執行緒與 ramp 的每個階段共用
+    server = radius_client.resolve_server(args.server)
 
-    if args.mode == 'run':
-        start_time = time.monotonic()
-        run_test(args.rps, args.duration, args.workers, args.server, secret_bytes)
-        total_time = time.monotonic() - start_time
+    if args.threads > 1 and sys._is_gil_enabled():
+        print("⚠️ The GIL is enabled: extra threads will not add CPU throughput. "
+              "Run under python3.13t with PYTHON_GIL=0 to scale across cores.")
 
-        print_statistics(total_time)
+    if args.mode == 'run':
         current_time_fn = time.strftime("%Y%m%d_%H%M%S")
         filename = f"results/run_{args.rps}rps_{args.duration}s_{current_time_fn}.csv"
-        save_results_to_csv(filename)
+
+        with open_results_csv(filename) as writer:
+            start_time = time.monotonic()
+            run_test(args.rps, args.duration, args.max_inflight, server, secret_bytes, writer, args.threads)
+            total_time = time.monotonic() - start_time
+
+        print_statistics(total_time)
 
     elif args.mode == 'ramp':
         print("--- 📈 Starting Ramping Test ---")
@@ -305,23 +304,19 @@ def main():
             reset_stats()  # 每個階段開始前重置統計數據
 
             start_time = time.monotonic()
-            run_test(rps, args.step_duration, args.workers, args.server, secret_bytes)
+            run_test(rps, args.step_duration, args.max_inflight, server, secret_bytes, threads=args.threads)
             total_time = time.monotonic() - start_time
 
             print(f"--- 📋 Results for {rps} RPS ---")
             print_statistics(total_time)
 
             # 檢查是否違反 SLO
-            if results:
-                durations = sorted([r['duration'] for r in results])
-                p95_index = int(len(durations) * 0.95) - 1
-                if p95_index >= 0:
-                    p95_latency = durations[p95_index]
-                    if p95_latency > slo_s:
-                        print(
-                            f"🚨 SLO VIOLATED! P95 Latency ({p95_latency * 1000:.2f}ms) > SLO ({args.slo_ms}ms) at {rps} RPS.")
-                        print("--- 🏁 Ramping Test Stopped ---")
-                        break
+            p95_latency = percentile_latency(stats['response_times'], 95)
+            if p95_latency > slo_s:
+                print(
+                    f"🚨 SLO VIOLATED! P95 Latency ({p95_latency * 1000:.2f}ms) > SLO ({args.slo_ms}ms) at {rps} RPS.")
+                print("--- 🏁 Ramping Test Stopped ---")
+                break
         else:
             print("--- ✅ Ramping Test Completed without violating SLO ---")
 
@@ -1,129 +1,118 @@
 import os
 import time
 import csv
-import threading
-import queue
-import hmac
-import hashlib
+import asyncio
 import argparse
+import itertools
+import math
 from collections import defaultdict
 from datetime import datetime
 
-from pyrad.client import Client
-from pyrad.dictionary import Dictionary
-import pyrad.packet
-import six
+from hdrh.histogram import HdrHistogram
 
-# 全域統計
-stats = {
-    'total_sent': 0,
-    'total_succeeded': 0,
-    'total_failed': 0,
-    'total_timeout': 0,
-    'response_times': []
-}
-stats_lock = threading.Lock()
+import radius_client
 
 
-def create_radius_client(server='127.0.0.1', secret=b'testing123'):
-    client = Client(server=server, authport=31812, secret=secret, dict=Dictionary("dictionary"))
+def new_stats():
+    """
+    建立一份空的統計數據。
+    response_times 為回應時間分佈 (微秒，1us ~ 60s，3 位有效數字)，
+    latency_mean/latency_m2 以 Welford 演算法逐筆累計平均與平方差總和 (奈秒)，記憶體用量不隨請求數增加。
+    """
+    return {
+        'total_sent': 0,
+        'total_succeeded': 0,
+        'total_failed': 0,
+        'total_timeout': 0,
+        'response_times': HdrHistogram(1, 60_000_000, 3),
+        'latency_mean': 0.0,
+        'latency_m2': 0.0
+    }
+
+
+# 全域統計 (所有請求都在同一個事件迴圈中執行，不需要鎖)
+stats = new_stats()
+
+
+async def create_radius_client(server, secret=b'testing123', max_inflight=1024):
+    sockets = math.ceil(max_inflight / radius_client.SOCKET_INFLIGHT)
+    client = await radius_client.open_client(server, secret, sockets=sockets)
     client.timeout = 5
     client.retries = 2
     return client
 
 
-def send_auth_request(client, username='testuser', password='testpassword', secret=b'testing123'):
-    start_time = time.monotonic()
+async def send_auth_request(client, template):
+    start_ns = time.monotonic_ns()
 
     try:
-        req = client.CreateAuthPacket(code=pyrad.packet.AccessRequest, User_Name=username)
-        req["User-Password"] = req.PwCrypt(password)
-        req["Message-Authenticator"] = 16 * six.b("\x00")
-        raw_packet = req.RequestPacket()
-        digest = hmac.new(secret, raw_packet, hashlib.md5).digest()
-        req["Message-Authenticator"] = digest
-
-        reply = client.SendPacket(req)
-
-        with stats_lock:
-            stats['total_succeeded'] += 1
+        await client.authenticate(template)
+        stats['total_succeeded'] += 1
 
-    except pyrad.client.Timeout:
-        with stats_lock:
-            stats['total_timeout'] += 1
+    except radius_client.Timeout:
+        stats['total_timeout'] += 1
     except Exception:
-        with stats_lock:
-            stats['total_failed'] += 1
+        stats['total_failed'] += 1
 
-    duration = time.monotonic() - start_time
+    duration_ns = time.monotonic_ns() - start_ns
 
-    with stats_lock:
-        stats['total_sent'] += 1
-        stats['response_times'].append(duration)
+    stats['total_sent'] += 1
+    stats['response_times'].record_value(duration_ns // 1000)
 
+    # Welford：以目前的樣本數更新平均與平方差總和
+    delta = duration_ns - stats['latency_mean']
+    stats['latency_mean'] += delta / stats['total_sent']
+    stats['latency_m2'] += delta * (duration_ns - stats['latency_mean'])
 
-def worker(task_queue, server='127.0.0.1', secret=b'testing123'):
-    client = create_radius_client(server, secret)
-    while True:
-        task = task_queue.get()
-        if task is None:
-            break
-        send_auth_request(client, secret=secret)
-        task_queue.task_done()
 
+async def run_test(rps, duration, server, max_inflight=1024, secret=b'testing123'):
+    client = await create_radius_client(server, secret, max_inflight)
+    template = client.create_auth_template(b'testuser', b'testpassword')
 
-def run_test(rps, duration, workers=50, server='127.0.0.1', secret=b'testing123'):
-    task_queue = queue.Queue(maxsize=workers * 2)
-    threads = []
-
-    for _ in range(workers):
-        thread = threading.Thread(target=worker, args=(task_queue, server, secret))
-        thread.start()
-        threads.append(thread)
-
-    start_time = time.monotonic()
-    test_end_time = start_time + duration
-    interval = 1.0 / rps if rps > 0 else 1.0
+    # 派發時間點以整數奈秒計算，不會累積浮點誤差
+    start_ns = time.monotonic_ns()
+    test_end_ns = start_ns + duration * 1_000_000_000
     total_tasks = int(rps * duration)
+    counter = itertools.count()
 
-    for i in range(total_tasks):
-        if time.monotonic() > test_end_time:
-            break
-
-        task_queue.put({"task": i})
+    # 每個 worker 從共用計數器取得請求編號，自行睡到 start + i * 10^9 // rps 奈秒再送出
+    async def worker():
+        while True:
+            i = next(counter)
+            if i >= total_tasks:
+                return
 
-        next_dispatch_time = start_time + (i + 1) * interval
-        sleep_duration = next_dispatch_time - time.monotonic()
-        if sleep_duration > 0:
-            time.sleep(sleep_duration)
+            now_ns = time.monotonic_ns()
+            deadline_ns = start_ns + i * 1_000_000_000 // rps
+            if now_ns < deadline_ns:
+                await asyncio.sleep((deadline_ns - now_ns) / 1e9)
+            elif now_ns > test_end_ns:
+                return
 
-    for _ in range(workers):
-        task_queue.put(None)
+            await send_auth_request(client, template)
 
-    for thread in threads:
-        thread.join()
+    await asyncio.gather(*(worker() for _ in range(max_inflight)))
+    client.close()
 
 
 def reset_stats():
     global stats
-    stats = {
-        'total_sent': 0,
-        'total_succeeded': 0,
-        'total_failed': 0,
-        'total_timeout': 0,
-        'response_times': []
-    }
+    stats = new_stats()
 
 
-def calculate_percentiles(times):
-    if not times:
+def calculate_percentiles(histogram):
+    if histogram.get_total_count() == 0:
         return 0, 0
-    sorted_times = sorted(times)
-    p95_idx = int(len(sorted_times) * 0.95) - 1
-    p99_idx = int(len(sorted_times) * 0.99) - 1
-    p95 = sorted_times[p95_idx] if p95_idx >= 0 else sorted_times[0]
-    p99 = sorted_times[p99_idx] if p99_idx >= 0 else sorted_times[0]
-    return p95 * 1000, p99 * 1000  # Convert to ms
+    p95 = histogram.get_value_at_percentile(95)
+    p99 = histogram.get_value_at_percentile(99)
+    return p95 / 1000, p99 / 1000  # Convert us to ms
+
+
+def calculate_latency_stdev(stats):
+    """由 Welford 累計的平方差總和計算樣本標準差 (ms)"""
+    if stats['total_sent'] < 2:
+        return 0
+    return math.sqrt(stats['latency_m2'] / (stats['total_sent'] - 1)) / 1_000_000
 
 
 def main():
@@ -164,6 +153,8 @@ def main():
                 })
 
         duration_per_hour = 30  # 2.5 minutes
+        # 伺服器位址只解析一次，每個小時的測試共用
+        server = radius_client.resolve_server('127.0.0.1')
         total_stats = defaultdict(int)
 
         # 執行模擬
@@ -176,19 +167,20 @@ def main():
             reset_stats()
 
             start_time = time.monotonic()
-            run_test(rps, duration_per_hour)
+            radius_client.run(run_test(rps, duration_per_hour, server))
             elapsed = time.monotonic() - start_time
 
             # 計算統計
             actual_rps = stats['total_sent'] / elapsed if elapsed > 0 else 0
             success_rate = (stats['total_succeeded'] / stats['total_sent'] * 100) if stats['total_sent'] > 0 else 0
             p95, p99 = calculate_percentiles(stats['response_times'])
-            avg_latency = (sum(stats['response_times']) / len(stats['response_times']) * 1000) if stats['response_times'] else 0
+            avg_latency = stats['latency_mean'] / 1_000_000
+            stdev_latency = calculate_latency_stdev(stats)
 
             # 輸出結果
             log_print(f"  Sent: {stats['total_sent']}, Success: {stats['total_succeeded']}, "
                       f"Failed: {stats['total_failed']}, Timeout: {stats['total_timeout']}")
-            log_print(f"  Success Rate: {success_rate:.1f}%, Avg Latency: {avg_latency:.1f}ms, P95: {p95:.1f}ms, P99: {p99:.1f}ms")
+            log_print(f"  Success Rate: {success_rate:.1f}%, Avg Latency: {avg_latency:.1f}ms, Stdev: {stdev_latency:.1f}ms, P95: {p95:.1f}ms, P99: {p99:.1f}ms")
 
             # 寫入 CSV
             csv_writer.writerow([
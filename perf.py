@@ -1,20 +1,19 @@
 import os
 import time
-import csv
-from concurrent.futures import ThreadPoolExecutor
-from pyrad.client import Client
-from pyrad.dictionary import Dictionary
-import pyrad.packet
-import threading
-import six
-import hmac
-import hashlib
+import math
+import random
+import asyncio
+from collections import deque
 import argparse
-from collections import defaultdict
 
-# 用於儲存結果的列表和鎖
-results = []
-results_lock = threading.Lock()
+import numpy as np
+
+import radius_client
+from radius_client import RadiusClient, AccessRequestTemplate
+
+# 每個封包的 (start, end)，以 time.perf_counter_ns() 的整數奈秒記錄在第 pkt_id - 1 列；
+# 在 main 中依封包總數預先配置，每一列只會被負責該封包的工作者寫入一次，不需要鎖也不需要事後排序
+timings = np.zeros((0, 2), dtype=np.int64)
 
 # 統計資訊
 stats = {
@@ -23,83 +22,60 @@ stats = {
     'total_succeeded': 0,
     'total_failed': 0,
     'total_no_reply': 0,
-    'response_times': defaultdict(int)
+    'response_times': [0] * 8  # 依 TIME_CATEGORIES 的順序
 }
-stats_lock = threading.Lock()
 
 
-def create_radius_client(server, secret):
-    """建立 RADIUS 客戶端"""
-    client = Client(server=server, authport=31812, secret=secret, dict=Dictionary("dictionary"))
-    client.timeout = 5
+async def create_radius_client(server, secret, parallel_clients):
+    """
+    建立所有工作者共用的 RADIUS 客戶端，server 為 radius_client.resolve_server() 解析好的位址。
+    每次嘗試只送一次、等待 5 秒，重送由 send_auth_request 自行處理並計入 total_retransmits。
+    """
+    sockets = math.ceil(parallel_clients / radius_client.SOCKET_INFLIGHT)
+    client = await radius_client.open_client(server, secret, sockets=sockets)
+    client.timeout = 5.0
+    client.retries = 1
     return client
 
 
-def categorize_response_time(duration):
-    """將回應時間分類"""
-    if duration < 0.00001:  # < 10 usec
-        return '< 10 usec'
-    elif duration < 0.0001:  # < 100 usec
-        return '< 100 usec'
-    elif duration < 0.001:  # < msec
-        return '< msec'
-    elif duration < 0.01:  # < 10 msec
-        return '< 10 msec'
-    elif duration < 0.1:  # < 0.1s
-        return '< 0.1s'
-    elif duration < 1:  # < s
-        return '< s'
-    elif duration < 10:  # < 10s
-        return '< 10s'
-    else:  # < 100s
-        return '< 100s'
-
-
-def send_auth_request(client, username, password, pkt_id, secret, max_retries=3):
-    """發送 RADIUS 認證請求"""
-    start = time.time()
+# 回應時間分類的上界 (秒)，超過最後一個上界的都歸在 < 100s
+TIME_BOUNDS = (0.00001, 0.0001, 0.001, 0.01, 0.1, 1, 10)
+TIME_CATEGORIES = ['< 10 usec', '< 100 usec', '< msec', '< 10 msec', '< 0.1s', '< s', '< 10s', '< 100s']
+
+
+def response_durations():
+    """每個封包的回應時間 (秒)，只在產生報告時才轉成浮點數"""
+    return (timings[:, 1] - timings[:, 0]) / 1e9
+
+
+def categorize_response_times(durations):
+    """一次計算所有回應時間落在 TIME_CATEGORIES 各分類的數量"""
+    indices = np.searchsorted(TIME_BOUNDS, durations, side='right')
+    return np.bincount(indices, minlength=len(TIME_CATEGORIES)).tolist()
+
+
+async def send_auth_request(client: RadiusClient, template: AccessRequestTemplate, pkt_id, max_retries=3):
+    """發送 RADIUS 認證請求，開始與結束時間寫入 timings 中屬於這個封包的那一列"""
+    start = time.perf_counter_ns()
     retries = 0
 
     while retries <= max_retries:
         try:
-            # 建立認證封包，插入 Message-Authenticator 為 16 個 0x00
-            req = client.CreateAuthPacket(
-                code=pyrad.packet.AccessRequest,
-                User_Name=username,
-            )
-            req["User-Password"] = req.PwCrypt(password)
-            req["Message-Authenticator"] = 16 * six.b("\x00")
-
-            # 取得原始封包二進位資料
-            raw_packet = req.RequestPacket()
-            # 計算 hmac-md5
-            digest = hmac.new(secret, raw_packet, hashlib.md5)
-            # 寫回 Message-Authenticator
-            req["Message-Authenticator"] = bytes.fromhex(digest.hexdigest())
-
-            # 發送請求
-            reply = client.SendPacket(req)
-            end = time.time()
-            duration = end - start
-
-            # 更新統計資訊
-            with stats_lock:
-                if retries == 0:
-                    stats['total_sent'] += 1
-                else:
-                    stats['total_retransmits'] += retries
-                stats['total_succeeded'] += 1
-                category = categorize_response_time(duration)
-                stats['response_times'][category] += 1
+            # 以預先組好的樣板產生封包 (含 Message-Authenticator) 並等待回應，只需要 header 就能判斷結果
+            reply = await client.authenticate(template)
+            if reply[0] != radius_client.ACCESS_ACCEPT:
+                raise ValueError(f"unexpected reply code {reply[0]}")
+            end = time.perf_counter_ns()
+
+            # 更新統計資訊 (所有工作者都在同一個事件迴圈中執行，不需要鎖)
+            if retries == 0:
+                stats['total_sent'] += 1
+            else:
+                stats['total_retransmits'] += retries
+            stats['total_succeeded'] += 1
 
             # 儲存結果
-            with results_lock:
-                results.append({
-                    'pkt_id': pkt_id,
-                    'start': start,
-                    'end': end,
-                    'duration': duration
-                })
+            timings[pkt_id - 1] = start, end
             return True
 
         except Exception as e:
@@ -107,58 +83,75 @@ def send_auth_request(client, username, password, pkt_id, secret, max_retries=3)
 
             # 如果還有重試次數，繼續重試
             if retries <= max_retries:
-                with stats_lock:
-                    if retries == 1:
-                        stats['total_sent'] += 1
-                    stats['total_retransmits'] += 1
+                if retries == 1:
+                    stats['total_sent'] += 1
+                stats['total_retransmits'] += 1
 
                 # 短暫等待後重試
-                time.sleep(0.1)
+                await asyncio.sleep(0.1)
                 continue
             else:
                 # 已達最大重試次數，記錄失敗
-                end = time.time()
-                duration = end - start
+                end = time.perf_counter_ns()
 
                 # 更新統計資訊
-                with stats_lock:
-                    if retries == 1:  # 第一次發送
-                        stats['total_sent'] += 1
-                    if "timeout" in str(e).lower():
-                        stats['total_no_reply'] += 1
-                    else:
-                        stats['total_failed'] += 1
+                if retries == 1:  # 第一次發送
+                    stats['total_sent'] += 1
+                if isinstance(e, radius_client.Timeout):
+                    stats['total_no_reply'] += 1
+                else:
+                    stats['total_failed'] += 1
 
                 # 儲存結果
-                with results_lock:
-                    results.append({
-                        'pkt_id': pkt_id,
-                        'start': start,
-                        'end': end,
-                        'duration': duration
-                    })
+                timings[pkt_id - 1] = start, end
                 return False
 
 
-def worker(worker_id, start_id, count, server, secret):
-    """每個並行工作者執行的函數"""
-    client = create_radius_client(server, secret)
-    for i in range(count):
-        pkt_id = start_id + i
-        send_auth_request(client, "testuser", "testpassword", pkt_id, secret)
+def take_next(deques, worker_id):
+    """
+    先從自己的 deque 右端取下一個封包編號；自己的已取完時，
+    從隨機順序的其他工作者 deque 左端偷一個。全部都空了回傳 None。
+    """
+    try:
+        return deques[worker_id].pop()
+    except IndexError:
+        pass
+    for victim in random.sample(range(len(deques)), len(deques)):
+        if victim == worker_id:
+            continue
+        try:
+            return deques[victim].popleft()
+        except IndexError:
+            continue
+    return None
 
 
-def save_results_to_csv(filename):
-    """將結果儲存到 CSV 檔案"""
-    with open(filename, 'w', newline='') as csvfile:
-        fieldnames = ['pkt_id', 'start', 'end', 'duration']
-        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-        writer.writeheader()
+async def worker(worker_id, deques, client, template):
+    """
+    每個並行工作者 (coroutine) 執行的函數，結果直接寫入 timings。
+    某個工作者卡在逾時重試時，其他閒置的工作者會把它還沒送出的封包偷走，避免最後只剩它在送。
+    """
+    while (pkt_id := take_next(deques, worker_id)) is not None:
+        await send_auth_request(client, template, pkt_id)
 
-        # 按 pkt_id 排序
-        sorted_results = sorted(results, key=lambda x: x['pkt_id'])
-        for result in sorted_results:
-            writer.writerow(result)
+
+async def run_test(deques, server, secret):
+    """在單一事件迴圈中以 len(deques) 個 worker coroutine 共用一個 RadiusClient 並行發送請求"""
+    client = await create_radius_client(server, secret, len(deques))
+    # 帳號密碼在整個測試中不變，封包只需組一次；build() 不會跨越 await，所有 worker 可共用
+    template = client.create_auth_template(b"testuser", b"testpassword")
+    await asyncio.gather(*(worker(i, deques, client, template) for i in range(len(deques))))
+    client.close()
+
+
+def save_results_to_csv(filename):
+    """將 timings 依 pkt_id 順序一次寫入 CSV 檔案 (時間皆為整數奈秒)"""
+    pkt_ids = np.arange(1, len(timings) + 1, dtype=np.int64)
+    durations_ns = timings[:, 1] - timings[:, 0]
+    # 1 MiB 的寫入緩衝區，減少 write() 系統呼叫次數
+    with open(filename, 'w', buffering=1 << 20, newline='') as csvfile:
+        np.savetxt(csvfile, np.column_stack((pkt_ids, timings, durations_ns)), delimiter=',', fmt='%d',
+                   header='pkt_id,start_ns,end_ns,duration_ns', comments='')
 
 
 def print_statistics(total_time):
@@ -175,14 +168,13 @@ def print_statistics(total_time):
         print(f"             Packets/s         :  {int(packets_per_sec)}")
 
     print("             Response times:")
-    time_categories = ['< 10 usec', '< 100 usec', '< msec', '< 10 msec', '< 0.1s', '< s', '< 10s', '< 100s']
-    for category in time_categories:
-        count = stats['response_times'].get(category, 0)
+    for category, count in zip(TIME_CATEGORIES, stats['response_times']):
         print(f"                {category:<11}: {count}")
 
     # 新增 <3s 與 >3s 百分比分析
-    total_requests = len(results)
-    under_3s = sum(1 for r in results if r['duration'] < 3)
+    durations = response_durations()
+    total_requests = len(durations)
+    under_3s = int(np.count_nonzero(durations < 3))
     over_3s = total_requests - under_3s
     if total_requests > 0:
         pct_under_3s = under_3s / total_requests * 100
@@ -190,15 +182,15 @@ def print_statistics(total_time):
         print(f"             < 3s             : {pct_under_3s:.2f}%")
         print(f"             > 3s             : {pct_over_3s:.2f}%")
 
-    # 新增 P95 latency
-    durations = sorted(r['duration'] for r in results)
-    if durations:
-        idx = int(0.95 * len(durations)) - 1
-        p95_latency = durations[idx]
+    # 新增 P95 latency (只需要部分排序就能取出第 idx 小的值)
+    if total_requests:
+        idx = int(0.95 * total_requests) - 1
+        p95_latency = np.partition(durations, idx)[idx]
         print("             P95 latency     :  {:.3f} s".format(p95_latency))
 
 
 def main():
+    global timings
     parser = argparse.ArgumentParser(description='RADIUS client performance test')
     parser.add_argument('-c', '--count', type=int, default=100, help='Total number of packets to send')
     parser.add_argument('-p', '--parallel', type=int, default=10, help='Number of parallel clients')
@@ -209,35 +201,37 @@ def main():
 
     total_packets = args.count
     parallel_clients = args.parallel
-    server = args.server
+    # 伺服器位址只解析一次，所有工作者共用
+    server = radius_client.resolve_server(args.server)
     secret = args.secret.encode()
 
     # 計算每個工作者要發送的封包數
     packets_per_worker = total_packets // parallel_clients
     remaining_packets = total_packets % parallel_clients
 
-    start_time = time.time()
+    # 每個封包一列 (start, end)，發送期間不再配置任何結果物件
+    timings = np.zeros((total_packets, 2), dtype=np.int64)
 
-    # 使用 ThreadPoolExecutor 並行發送請求
-    with ThreadPoolExecutor(max_workers=parallel_clients) as executor:
-        futures = []
-        current_id = 1
+    start_time = time.perf_counter()
 
-        for i in range(parallel_clients):
-            # 分配封包數量，確保總數正確
-            count = packets_per_worker + (1 if i < remaining_packets else 0)
-            if count > 0:
-                future = executor.submit(worker, i, current_id, count, server, secret)
-                futures.append(future)
-                current_id += count
+    # 每個工作者先分到連續的一段封包編號；deque 以遞減順序存放，自己從右端依序取、其他工作者從左端偷
+    deques = []
+    current_id = 1
+    for i in range(parallel_clients):
+        # 分配封包數量，確保總數正確
+        count = packets_per_worker + (1 if i < remaining_packets else 0)
+        deques.append(deque(range(current_id + count - 1, current_id - 1, -1)))
+        current_id += count
 
-        # 等待所有工作完成
-        for future in futures:
-            future.result()
+    # 以 asyncio 並行發送請求
+    radius_client.run(run_test(deques, server, secret))
 
-    end_time = time.time()
+    end_time = time.perf_counter()
     total_time = end_time - start_time
 
+    # 所有工作完成後一次計算回應時間分類
+    stats['response_times'] = categorize_response_times(response_durations())
+
     # 儲存結果到 CSV
     if not os.path.exists('results'):
         os.makedirs('results')
@@ -0,0 +1,253 @@
+"""
+非同步 RADIUS 用戶端
+
+以單一執行緒的 asyncio 事件迴圈驅動多個 UDP socket，每個 socket 以
+RADIUS Identifier (1 byte) 對應尚未收到回應的請求，
+因此一個核心即可同時維持數千個進行中的認證請求。
+"""
+import asyncio
+import hashlib
+import os
+import socket
+import struct
+from collections import deque
+from hmac import digest as hmac_digest
+
+import radius_io
+
+try:
+    import uvloop
+except ImportError:  # uvloop 為選用套件，不存在時使用標準事件迴圈
+    uvloop = None
+
+try:
+    import _radius_fast
+except ImportError:  # C 擴充模組需自行編譯 (見 _radius_fast.c)，不存在時使用純 Python 實作
+    _radius_fast = None
+
+AUTH_PORT = 31812
+
+ACCESS_REQUEST = 1
+ACCESS_ACCEPT = 2
+
+# RADIUS 屬性代碼 (對應 dictionary 檔)
+ATTR_USER_NAME = 1
+ATTR_USER_PASSWORD = 2
+ATTR_MESSAGE_AUTHENTICATOR = 80
+
+# Identifier 只有 1 byte，每個 socket 同時最多 256 個進行中的請求
+MAX_IDENTIFIERS = 256
+# 每個 socket 平時只用到 200 個，保留的 Identifier 讓剛釋放的編號不會馬上被重用，
+# 避免逾時請求遲到的回應被誤認為新請求的回應
+SOCKET_INFLIGHT = 200
+
+
+class Timeout(Exception):
+    """在所有重試次數內都沒有收到回應"""
+
+
+def pw_crypt(password: bytes, secret: bytes, authenticator: bytes) -> bytes:
+    """依 RFC 2865 5.2 加密 User-Password"""
+    buf = password + b'\x00' * (-len(password) % 16)
+    result = b''
+    last = authenticator
+    for i in range(0, len(buf), 16):
+        key = hashlib.md5(secret + last).digest()
+        last = (int.from_bytes(key) ^ int.from_bytes(buf[i:i + 16])).to_bytes(16)
+        result += last
+    return result
+
+
+def build_access_request(identifier: int, username: bytes, password: bytes, secret: bytes) -> bytes:
+    """組出含 User-Name、User-Password、Message-Authenticator 的 Access-Request 封包"""
+    authenticator = os.urandom(16)
+    user_password = pw_crypt(password, secret, authenticator)
+    attributes = (
+        struct.pack('!BB', ATTR_USER_NAME, len(username) + 2) + username
+        + struct.pack('!BB', ATTR_USER_PASSWORD, len(user_password) + 2) + user_password
+        + struct.pack('!BB', ATTR_MESSAGE_AUTHENTICATOR, 18) + 16 * b'\x00'
+    )
+    packet = bytearray(struct.pack('!BBH', ACCESS_REQUEST, identifier, 20 + len(attributes)))
+    packet += authenticator
+    packet += attributes
+
+    # Message-Authenticator 先填 16 bytes 的零計算 HMAC-MD5，再寫回封包尾端
+    packet[-16:] = hmac_digest(secret, packet, 'md5')
+    return bytes(packet)
+
+
+class AccessRequestTemplate:
+    """
+    預先組好的 Access-Request 封包。
+    帳號、密碼與 secret 在整個測試中不變，每次只改寫 Identifier、
+    Request Authenticator、User-Password 與 Message-Authenticator。
+    """
+
+    def __init__(self, username: bytes, password: bytes, secret: bytes):
+        self.password = password
+        self.secret = secret
+        self.base = bytearray(build_access_request(0, username, password, secret))
+        # 各欄位在封包中的位置：header (20) + User-Name TLV + User-Password 的 type/length
+        self.password_offset = 20 + 2 + len(username) + 2
+        self.password_end = self.password_offset + self.base[self.password_offset - 1] - 2
+        self.authenticator_offset = len(self.base) - 16
+        self.template = bytes(self.base)
+        # 密碼與 secret 固定：預先補齊並切好密碼區塊，並保留已吃進 secret 的 MD5 狀態，
+        # 每個封包只需對 Request Authenticator (或前一個密文區塊) 繼續計算
+        padded = password + b'\x00' * (-len(password) % 16)
+        self._password_blocks = [int.from_bytes(padded[i:i + 16]) for i in range(0, len(padded), 16)]
+        self._secret_md5 = hashlib.md5(secret)
+
+    def _pw_crypt(self, authenticator: bytes) -> bytes:
+        """與 pw_crypt() 結果相同，但沿用預先計算好的 secret MD5 狀態與密碼區塊"""
+        result = b''
+        last = authenticator
+        for block in self._password_blocks:
+            key = self._secret_md5.copy()
+            key.update(last)
+            last = (int.from_bytes(key.digest()) ^ block).to_bytes(16)
+            result += last
+        return result
+
+    def build(self, identifier: int) -> bytes:
+        """填入新的 Identifier 與隨機 Request Authenticator，回傳可直接送出的封包"""
+        if _radius_fast is not None:
+            # 加密與 HMAC 全部在 C 中釋放 GIL 執行
+            return _radius_fast.build_access_request(self.template, identifier, self.secret, self.password,
+                                                     self.password_offset, self.authenticator_offset)
+        base = self.base
+        authenticator = os.urandom(16)
+        base[1] = identifier
+        base[4:20] = authenticator
+        base[self.password_offset:self.password_end] = self._pw_crypt(authenticator)
+        base[self.authenticator_offset:] = 16 * b'\x00'
+        base[self.authenticator_offset:] = hmac_digest(self.secret, base, 'md5')
+        return bytes(base)
+
+
+class RadiusProtocol(asyncio.DatagramProtocol):
+    """單一 UDP socket，以 Identifier 對應等待中的回應 Future"""
+
+    def __init__(self):
+        self.transport = None
+        self.pending: dict[int, asyncio.Future] = {}
+        # 先進先出地回收 Identifier，讓逾時請求的遲到回應不容易撞到新請求
+        self.free_ids = deque(range(MAX_IDENTIFIERS))
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        if len(data) < 20:
+            return
+        future = self.pending.get(data[1])
+        if future is not None and not future.done():
+            future.set_result(data)
+
+    def error_received(self, exc):
+        # 例如 ICMP port unreachable：讓這個 socket 上所有等待中的請求失敗
+        for future in self.pending.values():
+            if not future.done():
+                future.set_exception(exc)
+
+    def connection_lost(self, exc):
+        for future in self.pending.values():
+            if not future.done():
+                future.set_exception(exc or ConnectionError('socket closed'))
+
+
+class RadiusClient:
+    """持有多個 RadiusProtocol，依序輪流把請求分配給各個 socket"""
+
+    def __init__(self, endpoints: list[RadiusProtocol], secret: bytes):
+        self.endpoints = endpoints
+        self._next_endpoint = 0
+        self.secret = secret
+        self.timeout = 5.0
+        self.retries = 2
+
+    def _pick_endpoint(self) -> RadiusProtocol:
+        """
+        輪到的 socket 進行中的請求未達 SOCKET_INFLIGHT 就直接使用，否則往後找下一個；
+        所有 socket 都達到上限時，才動用還有空閒 Identifier 的 socket
+        """
+        fallback = None
+        for _ in range(len(self.endpoints)):
+            endpoint = self.endpoints[self._next_endpoint]
+            self._next_endpoint = (self._next_endpoint + 1) % len(self.endpoints)
+            if len(endpoint.pending) < SOCKET_INFLIGHT:
+                return endpoint
+            if fallback is None and endpoint.free_ids:
+                fallback = endpoint
+        return fallback if fallback is not None else endpoint
+
+    def create_auth_template(self, username: bytes, password: bytes) -> AccessRequestTemplate:
+        """建立可重複使用的 Access-Request 樣板"""
+        return AccessRequestTemplate(username, password, self.secret)
+
+    async def authenticate(self, template: AccessRequestTemplate) -> bytes:
+        """以樣板送出一個 Access-Request 並回傳原始回應封包；逾時則拋出 Timeout"""
+        endpoint = self._pick_endpoint()
+        identifier = endpoint.free_ids.popleft()
+        packet = template.build(identifier)
+        future = asyncio.get_running_loop().create_future()
+        endpoint.pending[identifier] = future
+
+        try:
+            # 與 pyrad 相同：retries 為總發送次數，每次等待 timeout 秒
+            for _ in range(self.retries):
+                endpoint.transport.sendto(packet)
+                try:
+                    async with asyncio.timeout(self.timeout):
+                        return await asyncio.shield(future)
+                except TimeoutError:
+                    continue
+            raise Timeout
+        finally:
+            del endpoint.pending[identifier]
+            endpoint.free_ids.append(identifier)
+
+    def close(self):
+        for endpoint in self.endpoints:
+            endpoint.transport.close()
+
+
+def resolve_server(server: str, port: int = AUTH_PORT) -> tuple:
+    """
+    解析伺服器位址，回傳 (family, proto, address)。
+    在測試開始前解析一次，再傳給所有 open_client() 與工作者共用。
+    """
+    family, _, proto, _, address = socket.getaddrinfo(server, port, type=socket.SOCK_DGRAM)[0]
+    return family, proto, address
+
+
+async def open_client(server: str | tuple, secret: bytes, sockets: int = 1, port: int = AUTH_PORT) -> RadiusClient:
+    """
+    開啟指定數量的 UDP socket 並回傳 RadiusClient。
+    server 可以是主機名稱，或 resolve_server() 已解析好的位址 (此時忽略 port)。
+    在 Linux 上以 sendmmsg()/recvmmsg() 批次收送，其他平台使用 asyncio 內建的 transport。
+    """
+    loop = asyncio.get_running_loop()
+    if isinstance(server, str):
+        family, _, proto, _, address = (await loop.getaddrinfo(server, port, type=socket.SOCK_DGRAM))[0]
+    else:
+        family, proto, address = server
+    endpoints = []
+    for _ in range(sockets):
+        if radius_io.HAVE_MMSG:
+            sock = socket.socket(family, socket.SOCK_DGRAM, proto)
+            sock.setblocking(False)
+            sock.connect(address)
+            endpoint = RadiusProtocol()
+            radius_io.BatchDatagramTransport(loop, sock, endpoint)
+        else:
+            _, endpoint = await loop.create_datagram_endpoint(RadiusProtocol, remote_addr=address)
+        endpoints.append(endpoint)
+    return RadiusClient(endpoints, secret)
+
+
+def run(coro):
+    """執行 coroutine；有安裝 uvloop 時使用 uvloop 事件迴圈"""
+    if uvloop is not None:
+        return uvloop.run(coro)
+    return asyncio.run(coro)
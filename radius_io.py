@@ -0,0 +1,339 @@
+"""
+Linux sendmmsg()/recvmmsg() 與 io_uring 的 ctypes 包裝
+
+一次系統呼叫即可送出或接收最多 BATCH_SIZE 個 UDP datagram，
+取代每個封包各一次的 sendto()/recvfrom()。
+核心允許使用 io_uring 時，送出改以 io_uring 批次提交；否則使用 sendmmsg()。
+不支援的平台上 HAVE_MMSG 為 False，radius_client 會改用 asyncio 內建的 transport。
+"""
+import ctypes
+import errno
+import mmap
+import os
+import socket
+import struct
+import sys
+
+BATCH_SIZE = 64
+BUFFER_SIZE = 4096  # RADIUS 封包長度上限
+
+
+class iovec(ctypes.Structure):
+    _fields_ = [
+        ('iov_base', ctypes.c_void_p),
+        ('iov_len', ctypes.c_size_t),
+    ]
+
+
+class msghdr(ctypes.Structure):
+    _fields_ = [
+        ('msg_name', ctypes.c_void_p),
+        ('msg_namelen', ctypes.c_uint32),
+        ('msg_iov', ctypes.POINTER(iovec)),
+        ('msg_iovlen', ctypes.c_size_t),
+        ('msg_control', ctypes.c_void_p),
+        ('msg_controllen', ctypes.c_size_t),
+        ('msg_flags', ctypes.c_int),
+    ]
+
+
+class mmsghdr(ctypes.Structure):
+    _fields_ = [
+        ('msg_hdr', msghdr),
+        ('msg_len', ctypes.c_uint),
+    ]
+
+
+try:
+    _libc = ctypes.CDLL(None, use_errno=True)
+    _sendmmsg = _libc.sendmmsg
+    _recvmmsg = _libc.recvmmsg
+except (OSError, AttributeError):
+    _sendmmsg = _recvmmsg = _syscall = None
+else:
+    _sendmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(mmsghdr), ctypes.c_uint, ctypes.c_int]
+    _sendmmsg.restype = ctypes.c_int
+    _recvmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(mmsghdr), ctypes.c_uint, ctypes.c_int, ctypes.c_void_p]
+    _recvmmsg.restype = ctypes.c_int
+    _syscall = _libc.syscall
+    _syscall.restype = ctypes.c_long
+
+HAVE_MMSG = _sendmmsg is not None and hasattr(socket, 'MSG_DONTWAIT')
+# 是否真的能用還要看核心與 seccomp 設定，由 UringBatch 建立成功與否決定
+HAVE_URING = HAVE_MMSG and sys.platform == 'linux'
+
+# io_uring 的系統呼叫編號 (所有架構共用) 與 ABI 常數，見 <linux/io_uring.h>
+SYS_IO_URING_SETUP = 425
+SYS_IO_URING_ENTER = 426
+SYS_IO_URING_REGISTER = 427
+IORING_SETUP_SINGLE_ISSUER = 1 << 12
+IORING_SETUP_DEFER_TASKRUN = 1 << 13
+IORING_ENTER_GETEVENTS = 1 << 0
+IORING_REGISTER_FILES = 2
+IORING_OFF_SQ_RING = 0
+IORING_OFF_CQ_RING = 0x8000000
+IORING_OFF_SQES = 0x10000000
+IORING_OP_SEND = 26
+IOSQE_FIXED_FILE = 1 << 0
+IOSQE_IO_LINK = 1 << 2
+
+
+class io_sqring_offsets(ctypes.Structure):
+    _fields_ = [(name, ctypes.c_uint32) for name in
+                ('head', 'tail', 'ring_mask', 'ring_entries', 'flags', 'dropped', 'array', 'resv1')] + [
+        ('user_addr', ctypes.c_uint64),
+    ]
+
+
+class io_cqring_offsets(ctypes.Structure):
+    _fields_ = [(name, ctypes.c_uint32) for name in
+                ('head', 'tail', 'ring_mask', 'ring_entries', 'overflow', 'cqes', 'flags', 'resv1')] + [
+        ('user_addr', ctypes.c_uint64),
+    ]
+
+
+class io_uring_params(ctypes.Structure):
+    _fields_ = [(name, ctypes.c_uint32) for name in
+                ('sq_entries', 'cq_entries', 'flags', 'sq_thread_cpu', 'sq_thread_idle', 'features', 'wq_fd')] + [
+        ('resv', ctypes.c_uint32 * 3),
+        ('sq_off', io_sqring_offsets),
+        ('cq_off', io_cqring_offsets),
+    ]
+
+
+# struct io_uring_sqe (64 bytes) 與 struct io_uring_cqe (16 bytes)
+SQE = struct.Struct('<BBHiQQIIQHHiQQ')
+CQE = struct.Struct('<QiI')
+
+
+def _raise_errno():
+    err = ctypes.get_errno()
+    # OSError 會依 errno 自動轉成對應的子類別，例如 EAGAIN -> BlockingIOError
+    raise OSError(err, os.strerror(err))
+
+
+class MessageBatch:
+    """預先配置好的 mmsghdr/iovec/緩衝區陣列，可重複用於 sendmmsg()/recvmmsg()"""
+
+    def __init__(self, size: int = BATCH_SIZE, buffer_size: int = BUFFER_SIZE):
+        self.size = size
+        self.buffer_size = buffer_size
+        self.buffers = (ctypes.c_char * buffer_size * size)()
+        self.iovecs = (iovec * size)()
+        self.headers = (mmsghdr * size)()
+        self.addresses = [ctypes.addressof(buf) for buf in self.buffers]
+        for i in range(size):
+            self.iovecs[i].iov_base = self.addresses[i]
+            self.iovecs[i].iov_len = buffer_size
+            self.headers[i].msg_hdr.msg_iov = ctypes.pointer(self.iovecs[i])
+            self.headers[i].msg_hdr.msg_iovlen = 1
+
+    def send(self, fd: int, packets: list) -> int:
+        """以一次 sendmmsg() 送出 packets 開頭最多 size 個封包，回傳實際送出的數量"""
+        count = min(len(packets), self.size)
+        for i in range(count):
+            packet = packets[i]
+            ctypes.memmove(self.addresses[i], packet, len(packet))
+            self.iovecs[i].iov_len = len(packet)
+        sent = _sendmmsg(fd, self.headers, count, socket.MSG_DONTWAIT)
+        if sent < 0:
+            _raise_errno()
+        return sent
+
+    def recv(self, fd: int) -> list:
+        """以一次 recvmmsg() 取回目前已到達的 datagram (最多 size 個)"""
+        count = _recvmmsg(fd, self.headers, self.size, socket.MSG_DONTWAIT, None)
+        if count < 0:
+            _raise_errno()
+        return [ctypes.string_at(self.addresses[i], self.headers[i].msg_len) for i in range(count)]
+
+    def close(self):
+        """緩衝區由 ctypes 管理，沒有需要釋放的資源"""
+
+
+class UringBatch:
+    """
+    以 io_uring 送出的批次，介面與 MessageBatch.send() 相同。
+    socket 在建立時註冊為 fixed file，每批封包填成一串以 IOSQE_IO_LINK 串接的 IORING_OP_SEND，
+    一次 io_uring_enter() 提交並收回全部完成事件。
+    送出時帶 MSG_DONTWAIT，緩衝區已滿時會立即以 EAGAIN 完成，串在後面的請求則被取消，
+    因此與 sendmmsg() 一樣只會送出開頭連續的一段。
+    核心不支援或不允許 io_uring 時，建構子會拋出 OSError。
+    """
+
+    def __init__(self, fd: int, size: int = BATCH_SIZE, buffer_size: int = BUFFER_SIZE):
+        self.size = size
+        self.buffer_size = buffer_size
+        self.buffers = (ctypes.c_char * buffer_size * size)()
+        self.addresses = [ctypes.addressof(buf) for buf in self.buffers]
+
+        params = io_uring_params(flags=IORING_SETUP_SINGLE_ISSUER | IORING_SETUP_DEFER_TASKRUN)
+        ring_fd = _syscall(SYS_IO_URING_SETUP, ctypes.c_uint(size), ctypes.byref(params))
+        if ring_fd < 0 and ctypes.get_errno() == errno.EINVAL:
+            # 6.1 以前的核心不認得上面的旗標 (EINVAL)，改用預設設定
+            params = io_uring_params()
+            ring_fd = _syscall(SYS_IO_URING_SETUP, ctypes.c_uint(size), ctypes.byref(params))
+        if ring_fd < 0:
+            _raise_errno()
+        self.ring_fd = ring_fd
+        self.maps = []
+        try:
+            self.sq_ring = self._map(params.sq_off.array + params.sq_entries * 4, IORING_OFF_SQ_RING)
+            self.cq_ring = self._map(params.cq_off.cqes + params.cq_entries * CQE.size, IORING_OFF_CQ_RING)
+            self.sqes = self._map(params.sq_entries * SQE.size, IORING_OFF_SQES)
+
+            files = (ctypes.c_int * 1)(fd)
+            if _syscall(SYS_IO_URING_REGISTER, ctypes.c_int(ring_fd), ctypes.c_uint(IORING_REGISTER_FILES),
+                        files, ctypes.c_uint(1)) < 0:
+                _raise_errno()
+        except OSError:
+            self.close()
+            raise
+
+        self.sq_off = params.sq_off
+        self.cq_off = params.cq_off
+        self.sq_mask = struct.unpack_from('<I', self.sq_ring, self.sq_off.ring_mask)[0]
+        self.cq_mask = struct.unpack_from('<I', self.cq_ring, self.cq_off.ring_mask)[0]
+        # SQ array 固定對應到同位置的 SQE，之後只需要推進 tail
+        for i in range(params.sq_entries):
+            struct.pack_into('<I', self.sq_ring, self.sq_off.array + i * 4, i)
+
+    def _map(self, length: int, offset: int) -> mmap.mmap:
+        ring = mmap.mmap(self.ring_fd, length, flags=mmap.MAP_SHARED | getattr(mmap, 'MAP_POPULATE', 0),
+                         prot=mmap.PROT_READ | mmap.PROT_WRITE, offset=offset)
+        self.maps.append(ring)
+        return ring
+
+    def _enter(self, to_submit: int, min_complete: int):
+        while _syscall(SYS_IO_URING_ENTER, ctypes.c_uint(self.ring_fd), ctypes.c_uint(to_submit),
+                       ctypes.c_uint(min_complete), ctypes.c_uint(IORING_ENTER_GETEVENTS), None, ctypes.c_size_t(0)) < 0:
+            if ctypes.get_errno() != errno.EINTR:  # 被信號中斷時重試
+                _raise_errno()
+
+    def send(self, fd: int, packets: list) -> int:
+        """以一次 io_uring_enter() 送出 packets 開頭最多 size 個封包，回傳實際送出的數量 (fd 已在建立時註冊)"""
+        count = min(len(packets), self.size)
+        sq_tail = struct.unpack_from('<I', self.sq_ring, self.sq_off.tail)[0]
+        for i in range(count):
+            packet = packets[i]
+            ctypes.memmove(self.addresses[i], packet, len(packet))
+            flags = IOSQE_FIXED_FILE | (IOSQE_IO_LINK if i < count - 1 else 0)
+            SQE.pack_into(self.sqes, ((sq_tail + i) & self.sq_mask) * SQE.size,
+                          IORING_OP_SEND, flags, 0, 0, 0, self.addresses[i], len(packet), socket.MSG_DONTWAIT,
+                          i, 0, 0, 0, 0, 0)
+        # 沒有使用 SQPOLL，核心只在 io_uring_enter() 時讀取 tail，系統呼叫本身即保證寫入順序
+        struct.pack_into('<I', self.sq_ring, self.sq_off.tail, (sq_tail + count) & 0xFFFFFFFF)
+
+        results = [0] * count
+        completed = 0
+        submit = count
+        while completed < count:
+            self._enter(submit, count - completed)
+            submit = 0
+            head = struct.unpack_from('<I', self.cq_ring, self.cq_off.head)[0]
+            tail = struct.unpack_from('<I', self.cq_ring, self.cq_off.tail)[0]
+            while head != tail:
+                index, res, _ = CQE.unpack_from(self.cq_ring, self.cq_off.cqes + (head & self.cq_mask) * CQE.size)
+                results[index] = res
+                head = (head + 1) & 0xFFFFFFFF
+                completed += 1
+            struct.pack_into('<I', self.cq_ring, self.cq_off.head, head)
+
+        sent = 0
+        while sent < count and results[sent] >= 0:
+            sent += 1
+        if sent == 0:
+            err = -results[0]
+            raise OSError(err, os.strerror(err))
+        return sent
+
+    def close(self):
+        for ring in self.maps:
+            ring.close()
+        self.maps = []
+        if self.ring_fd >= 0:
+            os.close(self.ring_fd)
+            self.ring_fd = -1
+
+
+def new_send_batch(fd: int):
+    """io_uring 可用時以 UringBatch 送出，否則使用 sendmmsg() 的 MessageBatch"""
+    if HAVE_URING:
+        try:
+            return UringBatch(fd)
+        except OSError:
+            pass
+    return MessageBatch()
+
+
+class BatchDatagramTransport:
+    """
+    以 sendmmsg()/recvmmsg() 收送的已連線 UDP transport。
+    同一輪事件迴圈中呼叫 sendto() 的封包會累積起來，在下一輪一次送出；
+    socket 可讀時一次取回多個回應，再逐一交給 protocol.datagram_received()。
+    """
+
+    def __init__(self, loop, sock: socket.socket, protocol):
+        self._loop = loop
+        self._sock = sock
+        self._fd = sock.fileno()
+        self._protocol = protocol
+        self._queue = []
+        self._flush_scheduled = False
+        self._send_batch = new_send_batch(self._fd)
+        self._recv_batch = MessageBatch()
+        loop.add_reader(self._fd, self._read_ready)
+        protocol.connection_made(self)
+
+    def sendto(self, data, addr=None):
+        self._queue.append(data)
+        if len(self._queue) >= self._send_batch.size:
+            self._flush()
+        elif not self._flush_scheduled:
+            self._flush_scheduled = True
+            self._loop.call_soon(self._scheduled_flush)
+
+    def _scheduled_flush(self):
+        self._flush_scheduled = False
+        self._flush()
+
+    def _flush(self):
+        while self._queue:
+            try:
+                sent = self._send_batch.send(self._fd, self._queue)
+            except BlockingIOError:
+                # 送出緩衝區已滿，等 socket 可寫時再繼續
+                self._loop.add_writer(self._fd, self._write_ready)
+                return
+            except OSError as exc:
+                # 錯誤會讓 protocol 上所有等待中的請求失敗，剩下的封包也不必再送
+                self._queue.clear()
+                self._protocol.error_received(exc)
+                return
+            del self._queue[:sent]
+
+    def _write_ready(self):
+        self._loop.remove_writer(self._fd)
+        self._flush()
+
+    def _read_ready(self):
+        while True:
+            try:
+                datagrams = self._recv_batch.recv(self._fd)
+            except BlockingIOError:
+                return
+            except OSError as exc:
+                self._protocol.error_received(exc)
+                return
+            for data in datagrams:
+                self._protocol.datagram_received(data, None)
+            if len(datagrams) < self._recv_batch.size:
+                return
+
+    def close(self):
+        self._loop.remove_reader(self._fd)
+        self._loop.remove_writer(self._fd)
+        self._queue.clear()
+        self._send_batch.close()
+        self._sock.close()
+        self._protocol.connection_lost(None)
@@ -1,32 +1,80 @@
 import time
+import signal
+import functools
+import threading
 import subprocess
 import datetime
-from datetime import timedelta
-from scale_cached import predict_zone
+import numpy as np
+from scale_cached import predict_day
 import argparse
+
+try:
+    from kubernetes import client as k8s_client, config as k8s_config
+    from kubernetes.client.rest import ApiException
+except ImportError:  # kubernetes 套件為選用，不存在時改呼叫 ./kubectl
+    k8s_client = None
+
 LF = 48
+# 每個模擬小時之間的實際間隔 (秒)
+STEP_INTERVAL = 30
 
 
 def get_replica_count(predicted_rps):
-    """根據預測的 RPS 返回需要的 replica 數量"""
-    if predicted_rps <= 160:
-        return 1
-    # elif predicted_rps <= 320:
-    #     return 2
-    else:
-        return 3
+    """根據預測的 RPS 返回需要的 replica 數量，可一次傳入整天的預測 (Series/陣列)"""
+    return np.select([predicted_rps <= 160], [1], default=3)
+    # return np.select([predicted_rps <= 160, predicted_rps <= 320], [1, 2], default=3)
+
 
+# Pod 內 service account 的 namespace，load_incluster_config() 時使用
+SERVICE_ACCOUNT_NAMESPACE = '/var/run/secrets/kubernetes.io/serviceaccount/namespace'
+
+
+@functools.cache
+def get_apps_api():
+    """
+    載入 kubeconfig (在 Pod 內則改用 in-cluster 設定) 並建立 AppsV1Api，整個程式共用同一個 HTTPS 連線池；
+    回傳 (api, namespace)，兩種設定都載入失敗時回傳 None，改由 ./kubectl 處理
+    """
+    try:
+        k8s_config.load_kube_config()
+        _, context = k8s_config.list_kube_config_contexts()
+        return k8s_client.AppsV1Api(), context['context'].get('namespace', 'default')
+    except k8s_config.ConfigException:
+        pass
+    try:
+        k8s_config.load_incluster_config()
+        with open(SERVICE_ACCOUNT_NAMESPACE) as f:
+            namespace = f.read().strip()
+        return k8s_client.AppsV1Api(), namespace
+    except (k8s_config.ConfigException, OSError):
+        print(f"{datetime.datetime.now()}: No kubeconfig or in-cluster config, falling back to ./kubectl")
+        return None
+
+
+def scale_radius_app(replicas: int) -> bool:
+    """Scale the Kubernetes deployment "radius-app" to the specified number of replicas. Returns True on success."""
+    api = get_apps_api() if k8s_client is not None else None
+    if api is not None:
+        # 直接呼叫 scale subresource，不必每次 fork kubectl、解析 kubeconfig 並重新 TLS 握手
+        apps, namespace = api
+        try:
+            apps.patch_namespaced_deployment_scale("radius-app", namespace, {"spec": {"replicas": int(replicas)}})
+            print(f"{datetime.datetime.now()}: Scaled to {replicas} replicas")
+            return True
+        except ApiException as e:
+            print(f"{datetime.datetime.now()}: Scaling failed: {e.status} {e.reason}")
+            return False
 
-def scale_radius_app(replicas: int):
-    """Scale the Kubernetes deployment "radius-app" to the specified number of replicas."""
     cmd = [
         "./kubectl", "scale", "deployment", "radius-app", f"--replicas={replicas}"
     ]
     try:
         subprocess.run(cmd, check=True, capture_output=True)
         print(f"{datetime.datetime.now()}: Scaled to {replicas} replicas")
+        return True
     except subprocess.CalledProcessError as e:
         print(f"{datetime.datetime.now()}: Scaling failed: {e.stderr.decode().strip()}")
+        return False
 
     # cmd = [
     #     "./kubectl", "rollout", "restart", "deployment/radius-app"
@@ -50,32 +98,41 @@ def main():
     print("Starting proactive scaler - running every 2.5 minutes")
     print("Simulation date:", simulation_date.strftime("%Y-%m-%d"))
 
-    current_hour = 0
+    # 一次算出整天 24 小時的預測 load 與 replica 數量，迴圈中只負責 scaling 與等待
+    plan = predict_day(simulation_date)
+    plan['predicted_load'] = plan['yhat'] / 3600 * LF
+    plan['replicas'] = get_replica_count(plan['predicted_load'])
 
-    while current_hour <= 23:
-        # 計算當前模擬時間
-        current_simulation_time = simulation_date + timedelta(hours=current_hour)
-        ts = current_simulation_time.strftime("%Y-%m-%d %H:%M:%S")
+    # 最後一次成功套用的 replica 數量，相同時不再呼叫 scale
+    last_replicas = None
 
-        try:
-            # 預測下一個時間點的 load
-            predicted_load = predict_zone(ts) / 3600 * LF
+    # SIGINT/SIGTERM 時結束等待並停止，不必等完整個 sleep
+    stop = threading.Event()
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
 
-            # 根據預測的 load 決定 replica 數量
-            desired_replicas = get_replica_count(predicted_load)
+    # 第 i 個小時在 start + i * STEP_INTERVAL 觸發，scaling 花費的時間不會累積成漂移
+    start = time.monotonic()
 
-            print(f"Simulation time: {ts}, Predicted RPS: {predicted_load:.2f}, Replicas: {desired_replicas}")
+    for step, row in enumerate(plan.itertuples(index=False)):
+        ts = row.ds.strftime("%Y-%m-%d %H:%M:%S")
 
-            # 執行 scaling
-            scale_radius_app(desired_replicas)
+        try:
+            print(f"Simulation time: {ts}, Predicted RPS: {row.predicted_load:.2f}, Replicas: {row.replicas}")
+
+            # 執行 scaling (失敗時 last_replicas 不變，下一個小時會再試一次)
+            if row.replicas != last_replicas:
+                if scale_radius_app(row.replicas):
+                    last_replicas = row.replicas
+            else:
+                print(f"{datetime.datetime.now()}: Replicas unchanged, skipping scale")
 
         except Exception as ex:
             print(f"{datetime.datetime.now()}: Error determining or applying scale: {ex}")
 
-        time.sleep(30)
-
-        # 移動到下一個小時
-        current_hour += 1
+        if stop.wait(max(0.0, start + (step + 1) * STEP_INTERVAL - time.monotonic())):
+            print("Stopped by signal")
+            return
 
     print("Simulation completed for 24 hours")
 
@@ -1,60 +1,295 @@
+import hashlib
+import io
 import os
 import pickle
+from datetime import datetime
+import numpy as np
 import pandas as pd
 import holidays
 
-CACHE_FILE = 'scale_cache.pkl'
+try:
+    import pyarrow  # noqa: F401
+    CSV_ENGINE = 'pyarrow'
+except ImportError:  # pyarrow is optional; fall back to pandas' C parser
+    CSV_ENGINE = 'c'
+
+# Columnar cache read with a single np.load; the pickle is only read to migrate old caches
+CACHE_FILE = 'scale_cache.npz'
+LEGACY_CACHE_FILE = 'scale_cache.pkl'
+TRAIN_AVG_COLUMNS = ['hour_of_day', 'is_holiday', 'day_of_week', 'yhat']
+# Hourly 'ok' counts of parsed_logs.csv, keyed by the byte offset read up to, the file's mtime and
+# a fingerprint of the first and last FINGERPRINT_BYTES before that offset
+LOGS_FILE = 'parsed_logs.csv'
+OK_COUNT_CACHE_FILE = 'ok_count_cache.npz'
+FINGERPRINT_BYTES = 4096
+# Rows from DATA_START through DATA_END (inclusive) are counted; hours before TRAIN_END are averaged
+DATA_START = pd.Timestamp('2025-02-14')
+DATA_END = pd.Timestamp('2025-06-01')
+TRAIN_END = pd.Timestamp('2025-05-01')
+
+# (hour_of_day, is_holiday, day_of_week) packed into one slot: 24 hours x 2 x 7 days
+N_SLOTS = 24 * 14
+
+
+def pack_key(hour, is_holiday, day_of_week):
+    """
+    Pack the lookup columns into a single slot index. Works on scalars and numpy arrays.
+    """
+    return hour * 14 + is_holiday * 7 + day_of_week
+
+
+def build_holiday_dates(first_year: int) -> frozenset:
+    """
+    Taiwan public holidays from first_year through next year as plain date objects.
+    """
+    years = range(first_year, datetime.now().year + 2)
+    return frozenset(holidays.country_holidays('TW', years=years))
+
+
+def holiday_day_array(holiday_dates) -> np.ndarray:
+    """
+    Holiday dates as a sorted datetime64[D] array for holiday_flags.
+    """
+    return np.array(sorted(holiday_dates), dtype='datetime64[D]')
+
+
+def holiday_flags(ds: pd.Series, holiday_days: np.ndarray) -> np.ndarray:
+    """
+    Vectorized is_holiday column (public holiday or weekend) without a Python date column.
+    holiday_days must be sorted, as returned by holiday_day_array.
+    """
+    days = ds.to_numpy(dtype='datetime64[D]')
+    # Sorted-array membership: binary search, then compare the day found at each position
+    idx = np.searchsorted(holiday_days, days)
+    is_hol = holiday_days[np.minimum(idx, len(holiday_days) - 1)] == days if len(holiday_days) else False
+    # 1970-01-01 was a Thursday (weekday 3), so Saturday and Sunday are 5 and 6
+    is_weekend = (days.view(np.int64) + 3) % 7 >= 5
+    return is_hol | is_weekend
+
+
+def count_ok_hours(source):
+    """
+    Read time/type rows from source and bincount the 'ok' rows inside the data window
+    by epoch hour. Returns (first_hour, counts); counts is empty when there are none.
+    """
+    # Only time and type are used; dictionary-encode type so the 'ok' filter compares codes
+    df = pd.read_csv(source, usecols=['time', 'type'], dtype={'type': 'category'},
+                     parse_dates=['time'], engine=CSV_ENGINE)
+    df.set_index('time', inplace=True)
+    # Log rows are normally already in time order; sort only when they are not, then slice by binary search
+    if not df.index.is_monotonic_increasing:
+        df.sort_index(inplace=True)
+    df = df.loc[DATA_START:DATA_END]
+    # Hourly count of 'ok': bincount over epoch hours instead of resample('H')
+    ok_hours = df.index.values[(df['type'] == 'ok').to_numpy()].astype('datetime64[h]').astype(np.int64)
+    if not len(ok_hours):
+        return 0, np.zeros(0, dtype=np.int64)
+    first_hour = int(ok_hours.min())
+    return first_hour, np.bincount(ok_hours - first_hour)
+
+
+def merge_hour_counts(first_a, counts_a, first_b, counts_b):
+    """
+    Add two hourly count arrays that may start at different epoch hours.
+    """
+    if not len(counts_a):
+        return first_b, counts_b
+    if not len(counts_b):
+        return first_a, counts_a
+    first = min(first_a, first_b)
+    merged = np.zeros(max(first_a + len(counts_a), first_b + len(counts_b)) - first, dtype=np.int64)
+    merged[first_a - first:first_a - first + len(counts_a)] += counts_a
+    merged[first_b - first:first_b - first + len(counts_b)] += counts_b
+    return first, merged
+
+
+def hour_series(first_hour, counts) -> pd.Series:
+    """
+    Hourly counts starting at epoch hour first_hour as a Series indexed by time.
+    """
+    hours = (first_hour + np.arange(len(counts), dtype=np.int64)).astype('datetime64[h]')
+    return pd.Series(counts, index=pd.DatetimeIndex(hours, name='time'))
+
+
+def prefix_fingerprint(f, offset: int) -> str:
+    """
+    Hash of the first and last FINGERPRINT_BYTES of f before offset (the header and the
+    first and last rows read), used to tell an appended file from a regenerated one.
+    """
+    f.seek(0)
+    head = f.read(min(offset, FINGERPRINT_BYTES))
+    tail_start = max(0, offset - FINGERPRINT_BYTES)
+    f.seek(tail_start)
+    tail = f.read(offset - tail_start)
+    return hashlib.blake2b(head + tail, digest_size=16).hexdigest()
+
+
+def read_complete_rows(offset: int):
+    """
+    Read LOGS_FILE from offset through its last newline, so a row still being written is
+    left for the next read. Returns (csv bytes with the header line prepended, the offset
+    after the last complete row, mtime_ns of the file when it was opened, fingerprint of
+    the bytes before that offset).
+    """
+    with open(LOGS_FILE, 'rb') as f:
+        mtime_ns = os.fstat(f.fileno()).st_mtime_ns
+        header = f.readline()
+        if not header.endswith(b'\n'):
+            return b'', 0, mtime_ns, prefix_fingerprint(f, 0)
+        start = max(offset, len(header))
+        f.seek(start)
+        data = f.read()
+        end = start + data.rfind(b'\n') + 1
+        return header + data[:end - start], end, mtime_ns, prefix_fingerprint(f, end)
+
+
+def load_ok_count() -> pd.Series:
+    """
+    Hourly 'ok' counts of LOGS_FILE. When the file only grew since the cached counts
+    were taken, only the rows after the cached offset are parsed; otherwise the whole file is read.
+    """
+    stat = os.stat(LOGS_FILE)
+    offset, first_hour, counts = 0, 0, np.zeros(0, dtype=np.int64)
+    if os.path.exists(OK_COUNT_CACHE_FILE):
+        with np.load(OK_COUNT_CACHE_FILE) as data:
+            # Caches without a fingerprint predate it and are rebuilt; a shrunken file was rewritten
+            if 'fingerprint' in data and stat.st_size >= int(data['offset']):
+                cached_offset = int(data['offset'])
+                if stat.st_size == cached_offset:
+                    # Same size: unchanged if the mtime matches, otherwise regenerated
+                    if stat.st_mtime_ns == int(data['mtime_ns']):
+                        return hour_series(int(data['first_hour']), data['counts'])
+                else:
+                    with open(LOGS_FILE, 'rb') as f:
+                        appended = prefix_fingerprint(f, cached_offset) == data['fingerprint'].item()
+                    if appended:
+                        offset, first_hour, counts = cached_offset, int(data['first_hour']), data['counts']
+    # The header is prepended to the new rows, so the tail parses like a whole file with either engine
+    rows, new_offset, mtime_ns, fingerprint = read_complete_rows(offset)
+    if new_offset > offset:
+        first_hour, counts = merge_hour_counts(first_hour, counts, *count_ok_hours(io.BytesIO(rows)))
+    np.savez(OK_COUNT_CACHE_FILE, offset=new_offset, mtime_ns=mtime_ns, fingerprint=fingerprint,
+             first_hour=first_hour, counts=counts)
+    return hour_series(first_hour, counts)
 
 
 def build_cache():
     # Compute thresholds and training averages
-    tw_holidays = holidays.country_holidays('TW')
-    # Load and filter data
-    df = pd.read_csv('parsed_logs.csv', parse_dates=['time'])
-    df.set_index('time', inplace=True)
-    df = df[(df.index >= pd.Timestamp('2025-02-14')) & (df.index <= pd.Timestamp('2025-06-01'))]
-    # Hourly count of 'ok'
-    ok_count = df[df['type'] == 'ok'].resample('H').size()
+    holiday_dates = build_holiday_dates(DATA_START.year)
+    ok_count = load_ok_count()
     # Thresholds
     max_ok = ok_count.max()
     thresholds = [0, 0, 0] if max_ok == 0 else [max_ok / 3, max_ok * 2 / 3, max_ok]
     # Prepare training averages
     count_df = ok_count.reset_index(name='y').rename(columns={'time': 'ds'})
     count_df['hour_of_day'] = count_df['ds'].dt.hour
-    count_df['is_holiday'] = count_df['ds'].dt.date.isin(tw_holidays) | (count_df['ds'].dt.weekday >= 5)
+    count_df['is_holiday'] = holiday_flags(count_df['ds'], holiday_day_array(holiday_dates))
     count_df['day_of_week'] = count_df['ds'].dt.weekday
-    train_df = count_df[(count_df['ds'] >= pd.Timestamp('2025-02-14')) & (count_df['ds'] < pd.Timestamp('2025-05-01'))]
-    train_avg = train_df.groupby(['hour_of_day', 'is_holiday', 'day_of_week'])['y'].mean().reset_index(name='yhat')
+    # ok_count is hourly and sorted: the training hours are one contiguous slice ending before TRAIN_END
+    train_df = count_df.iloc[ok_count.index.searchsorted(DATA_START):ok_count.index.searchsorted(TRAIN_END)]
+    # Per-slot mean via bincount instead of groupby().mean()
+    key = pack_key(train_df['hour_of_day'].to_numpy(), train_df['is_holiday'].to_numpy(np.int8),
+                   train_df['day_of_week'].to_numpy())
+    sums = np.bincount(key, weights=train_df['y'].to_numpy(np.float64), minlength=N_SLOTS)
+    counts = np.bincount(key, minlength=N_SLOTS)
+    slots = np.flatnonzero(counts)
+    train_avg = pd.DataFrame({
+        'hour_of_day': slots // 14,
+        'is_holiday': slots % 14 >= 7,
+        'day_of_week': slots % 7,
+        'yhat': sums[slots] / counts[slots],
+    })
     # Cache results
-    with open(CACHE_FILE, 'wb') as f:
-        pickle.dump({'thresholds': thresholds, 'train_avg': train_avg}, f)
-    return thresholds, train_avg, tw_holidays
+    save_cache(thresholds, train_avg, holiday_dates)
+    return thresholds, train_avg, build_lut(train_avg), holiday_dates
+
+
+def save_cache(thresholds, train_avg, holiday_dates):
+    """
+    Write thresholds, train_avg columns and holiday dates as plain numpy arrays.
+    """
+    np.savez(CACHE_FILE,
+             thresholds=np.asarray(thresholds, dtype=np.float64),
+             holiday_days=holiday_day_array(holiday_dates),
+             **{column: train_avg[column].to_numpy() for column in TRAIN_AVG_COLUMNS})
+
+
+def build_lut(train_avg) -> np.ndarray:
+    """
+    Flat table of N_SLOTS yhat values indexed by pack_key; slots without training data are 0.
+    """
+    lut = np.zeros(N_SLOTS, dtype=np.float64)
+    lut[pack_key(train_avg['hour_of_day'].to_numpy(), train_avg['is_holiday'].to_numpy(np.int8),
+                 train_avg['day_of_week'].to_numpy())] = train_avg['yhat'].to_numpy(np.float64)
+    return lut
 
 
 def load_cache():
     if os.path.exists(CACHE_FILE):
-        with open(CACHE_FILE, 'rb') as f:
+        with np.load(CACHE_FILE) as data:
+            thresholds = data['thresholds'].tolist()
+            train_avg = pd.DataFrame({column: data[column] for column in TRAIN_AVG_COLUMNS})
+            holiday_dates = frozenset(data['holiday_days'].tolist())
+        return thresholds, train_avg, build_lut(train_avg), holiday_dates
+    elif os.path.exists(LEGACY_CACHE_FILE):
+        with open(LEGACY_CACHE_FILE, 'rb') as f:
             data = pickle.load(f)
-        tw_holidays = holidays.country_holidays('TW')
-        return data['thresholds'], data['train_avg'], tw_holidays
+        # Pickled caches from older versions may lack the holiday set
+        holiday_dates = data['holiday_dates'] if 'holiday_dates' in data else build_holiday_dates(DATA_START.year)
+        save_cache(data['thresholds'], data['train_avg'], holiday_dates)
+        return data['thresholds'], data['train_avg'], build_lut(data['train_avg']), holiday_dates
     else:
         return build_cache()
 
 
 # Load or build cache once at import
-thresholds, train_avg, tw_holidays = load_cache()
+thresholds, train_avg, lut, holiday_dates = load_cache()
+holiday_days = holiday_day_array(holiday_dates)
+# Years whose holidays are in holiday_dates; other years are added on first use by cover_holiday_year
+holiday_years = {day.year for day in holiday_dates}
+# Upper bounds (inclusive) of zones 1 and 2; anything above falls in zone 3
+zone_bounds = np.asarray(thresholds[:2], dtype=np.float64)
+
+
+def assign_zone(val):
+    """
+    Assign zone based on thresholds. Accepts a scalar or an array of values.
+    """
+    zones = np.searchsorted(zone_bounds, val, side='left') + 1
+    return int(zones) if np.ndim(zones) == 0 else zones
+
+
+def cover_holiday_year(year: int):
+    """
+    Add Taiwan public holidays of year to holiday_dates and holiday_days if the cache
+    does not cover it, so dates past the cached range are not treated as workdays.
+    """
+    global holiday_dates, holiday_days
+    if year in holiday_years:
+        return
+    holiday_years.add(year)
+    holiday_dates = holiday_dates | frozenset(holidays.country_holidays('TW', years=year))
+    holiday_days = holiday_day_array(holiday_dates)
 
 
-def assign_zone(val: float) -> int:
+def predict_yhat(timestamp) -> float:
     """
-    Assign zone based on thresholds.
+    Predict the hourly 'ok' count for a given timestamp.
+    Input can be a string or datetime-like object.
     """
-    if val <= thresholds[0]:
-        return 1
-    elif val <= thresholds[1]:
-        return 2
+    # pd.to_datetime is slow on a single scalar; try ISO strings directly first
+    if isinstance(timestamp, datetime):
+        ts = timestamp
     else:
-        return 3
+        try:
+            ts = datetime.fromisoformat(timestamp)
+        except (TypeError, ValueError):
+            # Other formats such as '2025/04/04 10:00' and non-string inputs
+            ts = pd.to_datetime(timestamp)
+    cover_holiday_year(ts.year)
+    dow = ts.weekday()
+    is_hol = ts.date() in holiday_dates or dow >= 5
+    return float(lut[pack_key(ts.hour, int(is_hol), dow)])
 
 
 def predict_zone(timestamp) -> int:
@@ -62,18 +297,19 @@ def predict_zone(timestamp) -> int:
     Predict the replica zone (1, 2, or 3) for a given timestamp.
     Input can be a string or datetime-like object.
     """
-    ts = pd.to_datetime(timestamp)
-    hour = ts.hour
-    is_hol = ts.date() in tw_holidays or ts.weekday() >= 5
-    dow = ts.weekday()
-    grp = train_avg[
-        (train_avg.hour_of_day == hour) &
-        (train_avg.is_holiday == is_hol) &
-        (train_avg.day_of_week == dow)
-    ]
-    yhat = float(grp['yhat'].iloc[0]) if not grp.empty else 0.0
-    return yhat
-    return assign_zone(yhat)
+    return assign_zone(predict_yhat(timestamp))
+
+
+def predict_day(date) -> pd.DataFrame:
+    """
+    Predict yhat and zone for all 24 hours of a date with one indexing op into lut.
+    Returns a DataFrame with columns ds, yhat and zone.
+    """
+    day = pd.Timestamp(date).normalize()
+    cover_holiday_year(day.year)
+    ds = pd.Series(pd.date_range(day, periods=24, freq=pd.Timedelta(hours=1)), name='ds')
+    yhat = lut[pack_key(np.arange(24), holiday_flags(ds, holiday_days).astype(np.int8), day.weekday())]
+    return pd.DataFrame({'ds': ds, 'yhat': yhat, 'zone': assign_zone(yhat)})
 
 
 if __name__ == '__main__':
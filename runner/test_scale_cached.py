@@ -0,0 +1,104 @@
+"""
+Incremental ok_count cache checks for appended and regenerated logs.
+Run from runner/: python -m unittest test_scale_cached
+"""
+import importlib
+import os
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+HEADER = b'time,type,user\n'
+
+
+def log_rows(start, n, seed):
+    """n CSV rows (bytes) a few minutes apart starting at start, mostly 'ok'."""
+    rng = np.random.default_rng(seed)
+    times = pd.Timestamp(start) + pd.to_timedelta(np.cumsum(rng.integers(1, 600, n)), unit='s')
+    types = rng.choice(['ok', 'fail'], size=n, p=[0.8, 0.2])
+    return b''.join(f'{t:%Y-%m-%d %H:%M:%S},{k},u{i}\n'.encode() for i, (t, k) in enumerate(zip(times, types)))
+
+
+class OkCountCacheTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # scale_cached builds its cache from parsed_logs.csv in the working directory at import
+        cls.cwd = os.getcwd()
+        cls.tmp = tempfile.TemporaryDirectory()
+        os.chdir(cls.tmp.name)
+        with open('parsed_logs.csv', 'wb') as f:
+            f.write(HEADER + log_rows('2025-02-20', 2000, 0))
+        cls.scale_cached = importlib.import_module('scale_cached')
+        cls.engine = cls.scale_cached.CSV_ENGINE
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.scale_cached.CSV_ENGINE = cls.engine
+        os.chdir(cls.cwd)
+        cls.tmp.cleanup()
+
+    def write_logs(self, data):
+        with open('parsed_logs.csv', 'wb') as f:
+            f.write(data)
+
+    def full_count(self):
+        os.remove(self.scale_cached.OK_COUNT_CACHE_FILE)
+        return self.scale_cached.load_ok_count()
+
+    def check_incremental(self, engine):
+        self.scale_cached.CSV_ENGINE = engine
+        head, tail = log_rows('2025-03-01', 3000, 1), log_rows('2025-04-01', 3000, 2)
+        # The first read ends in the middle of a row; the rest of it arrives with the tail
+        cut = len(head) - 7
+        self.write_logs(HEADER + head[:cut])
+        if os.path.exists(self.scale_cached.OK_COUNT_CACHE_FILE):
+            os.remove(self.scale_cached.OK_COUNT_CACHE_FILE)
+        self.scale_cached.load_ok_count()
+        with open('parsed_logs.csv', 'ab') as f:
+            f.write(head[cut:] + tail)
+        incremental = self.scale_cached.load_ok_count()
+        cached = self.scale_cached.load_ok_count()
+        full = self.full_count()
+        pd.testing.assert_series_equal(incremental, full)
+        pd.testing.assert_series_equal(cached, full)
+        self.assertEqual(full.sum(), sum(line.split(b',')[1] == b'ok' for line in (head + tail).splitlines()))
+
+    def check_rewrite(self, engine):
+        self.scale_cached.CSV_ENGINE = engine
+        rows = log_rows('2025-03-01', 3000, 3)
+        self.write_logs(HEADER + rows)
+        full = self.full_count()
+        self.assertGreater(full.sum(), 0)
+        # Regenerated with the same byte length: every 'ok' becomes 'no'
+        self.write_logs(HEADER + rows.replace(b',ok,', b',no,'))
+        os.utime('parsed_logs.csv', ns=(0, os.stat('parsed_logs.csv').st_mtime_ns + 1))
+        self.assertEqual(self.scale_cached.load_ok_count().sum(), 0)
+        # Regenerated larger: the old rows must not be kept or counted twice
+        self.write_logs(HEADER + log_rows('2025-04-01', 4000, 4))
+        pd.testing.assert_series_equal(self.scale_cached.load_ok_count(), self.full_count())
+
+    def test_incremental_c_engine(self):
+        self.check_incremental('c')
+
+    def test_incremental_pyarrow_engine(self):
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            self.skipTest('pyarrow is not installed')
+        self.check_incremental('pyarrow')
+
+    def test_rewrite_c_engine(self):
+        self.check_rewrite('c')
+
+    def test_rewrite_pyarrow_engine(self):
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            self.skipTest('pyarrow is not installed')
+        self.check_rewrite('pyarrow')
+
+
+if __name__ == '__main__':
+    unittest.main()